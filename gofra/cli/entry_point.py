@@ -10,17 +10,17 @@ from .errors import cli_user_error_handler
 from .output import cli_message
 
 
+@cli_user_error_handler
 def cli_entry_point() -> None:
-    with cli_user_error_handler():
-        args = parse_cli_arguments()
-        context = process_input_file(
-            args.filepath,
-            optimize=not args.no_optimizations,
-            typecheck=not args.no_typecheck,
-            include_search_directories=args.include_search_directories,
-        )
-        if args.action_compile:
-            _cli_compile_action(context, args)
+    args = parse_cli_arguments()
+    context = process_input_file(
+        args.filepath,
+        optimize=not args.no_optimizations,
+        typecheck=not args.no_typecheck,
+        include_search_directories=args.include_search_directories,
+    )
+    if args.action_compile:
+        _cli_compile_action(context, args)
 
 
 def _cli_compile_action(context: ProgramContext, args: CLIArguments) -> None:
@@ -1,14 +1,20 @@
-from collections.abc import Generator
-from contextlib import contextmanager
+from collections.abc import Callable
+from functools import wraps
 
 from gofra.exceptions import GofraError
 
 from .output import cli_message
 
 
-@contextmanager
-def cli_user_error_handler() -> Generator[None]:
-    try:
-        yield
-    except GofraError as ge:
-        cli_message("ERROR", repr(ge))
+def cli_user_error_handler[**P, R](function: Callable[P, R]) -> Callable[P, R | None]:
+    """Report user errors (e.g invalid source) raised within function as CLI error message."""
+
+    @wraps(function)
+    def wrapper(*args: P.args, **kwargs: P.kwargs) -> R | None:
+        try:
+            return function(*args, **kwargs)
+        except GofraError as ge:
+            cli_message("ERROR", repr(ge))
+            return None
+
+    return wrapper
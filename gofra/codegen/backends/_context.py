@@ -1,15 +1,34 @@
-from collections.abc import MutableMapping
+from collections.abc import Collection, MutableMapping, MutableSequence, Sequence
 from dataclasses import dataclass, field
-from typing import IO
 
 
-@dataclass(frozen=True)
+@dataclass(frozen=False)
 class CodegenContext:
-    fd: IO[str]
     strings: MutableMapping[str, str] = field(default_factory=lambda: dict())  # noqa: C408
 
-    def write(self, *lines: str) -> int:
-        return self.fd.write("\t" + "\n\t".join(lines) + "\n")
+    # Resulting assembly chunks, written into output file at once when generation is done
+    buf: MutableSequence[str] = field(default_factory=lambda: list())  # noqa: C408
+
+    # Instructions of current basic block which are not written into `buf` yet
+    # Backend flushes them at block boundaries so whole block can be optimized at once
+    block: MutableSequence[str] = field(default_factory=lambda: list())  # noqa: C408
+
+    # Top of the stack is held within X0 register and not stored onto stack
+    # Must be spilled onto stack before leaving basic block
+    tos_in_reg: bool = field(default=False)
+
+    # Functions which calls are expanded with their body instead of being called
+    inlined_functions: Collection[str] = field(default_factory=frozenset)
+
+    # Functions that are defined outside and linked (looked up once, not per each call)
+    extern_functions: Collection[str] = field(default_factory=frozenset)
+
+    # Preformatted labels of jump targets and loop exits, indexed by operator index
+    labels: Sequence[str] = field(default_factory=tuple)
+    labels_over: Sequence[str] = field(default_factory=tuple)
+
+    def write(self, *lines: str) -> None:
+        self.block.append("\t" + "\n\t".join(lines) + "\n")
 
     def load_string(self, string: str) -> str:
         string_key = "str%d" % len(self.strings)
@@ -1,21 +1,229 @@
-from collections.abc import Sequence
+import operator as python_operator
+import re
+from collections import defaultdict
+from collections.abc import Callable, Collection, Iterator, Mapping, Sequence
 from datetime import datetime
+from graphlib import TopologicalSorter
 from typing import IO
 
+from gofra.codegen.exceptions import CodegenIntegerOutOfRangeError
 from gofra.context import ProgramContext
-from gofra.parser.intrinsics import Intrinsic
+from gofra.parser.functions import Function
+from gofra.parser.intrinsics import SYSCALL_ARGUMENTS_COUNT, Intrinsic
 from gofra.parser.operators import Operator, OperatorType
 
 from ._context import CodegenContext
 
 
+def _asm_block(*instructions: str) -> str:
+    """Join instructions into single block that is ready to be written as-is."""
+    return "\t" + "\n\t".join(instructions) + "\n"
+
+
+def _make_intrinsic_table[T](mapping: Mapping[Intrinsic, T]) -> list[T | None]:
+    """Make table indexed by intrinsic value (`None` for intrinsics that are not within mapping).
+
+    Intrinsics are looked up within hot dispatch loop, so it is plain list indexing rather than mapping lookup.
+    """
+    table: list[T | None] = [None] * (max(Intrinsic) + 1)
+    for intrinsic, value in mapping.items():
+        table[intrinsic] = value
+    return table
+
+
+# Pre-joined instruction blocks for each operator, so emitting an operator is a single write
+# Operand dependant parts are `str.format` placeholders
+# (Intrinsic and OperatorType are both `IntEnum`s with overlapping values so they cannot share one table)
+#
+# Each stack slot is 16 bytes wide (keeps SP aligned), so stack adjustments are folded
+# into pre-indexed (push) / post-indexed (pop) addressing of loads and stores
+#
+# Top of the stack is cached within X0 register (see `CodegenContext.tos_in_reg`)
+# Operators expects top of the stack to be already loaded into X0 (rest of the stack is in memory)
+# and leaves their result (new top of the stack) inside X0 without storing it onto stack
+_ARM64_OPERATOR_TEMPLATES: dict[OperatorType, str] = {
+    # Length of the string is moved afterwards (see `_move_immediate`)
+    OperatorType.PUSH_STRING: _asm_block(
+        "adr X0, {0}",
+        "str X0, [SP, #-16]!",
+    ),
+    # Conditions consumes top of the stack, so nothing is left cached
+    # placeholder is the label to branch into (see `_make_labels`)
+    OperatorType.DO: _asm_block(
+        "cmp X0, #1",
+        "bne {0}",
+    ),
+    OperatorType.IF: _asm_block(
+        "cmp X0, #1",
+        "bne {0}",
+    ),
+}
+_ARM64_PUSH_STRING_TEMPLATE = _ARM64_OPERATOR_TEMPLATES[OperatorType.PUSH_STRING]
+_ARM64_LOOP_BACK_TEMPLATE = _asm_block("b {0}")
+
+_ARM64_DEBUG_OPERATOR_COMMENT_TEMPLATE = _asm_block("// * {0} {1} from {2}{3}")
+
+# Immediates that fits into single `movz`/`movn` (without shift) are moved as-is,
+# others are built from 16 bit chunks (see `_move_immediate`)
+_ARM64_MOVE_IMMEDIATE_TEMPLATE = _asm_block("mov {0}, #{1:d}")
+_ARM64_MOVE_IMMEDIATE_MIN = -(2**16)
+_ARM64_MOVE_IMMEDIATE_MAX = 2**16 - 1
+
+_ARM64_SPILL_TOS = _asm_block("str X0, [SP, #-16]!")
+_ARM64_LOAD_TOS = _asm_block("ldr X0, [SP], #16")
+_ARM64_PEEK_TOS = _asm_block("ldr X0, [SP]")
+_ARM64_DROP = _asm_block("add SP, SP, #16")
+
+# Comparisons directly followed by condition, branch over the body if comparison does not hold
+# (inverted condition code of the comparison), placeholder is the label to branch into
+_CONDITION_OPERATOR_TYPES = frozenset((OperatorType.IF, OperatorType.DO))
+_ARM64_COMPARE_AND_BRANCH_TEMPLATES = _make_intrinsic_table(
+    {
+        Intrinsic.EQUAL: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "b.ne {0}",
+        ),
+        Intrinsic.NOT_EQUAL: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "b.eq {0}",
+        ),
+        Intrinsic.LESS_THAN: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "b.ge {0}",
+        ),
+        Intrinsic.LESS_EQUAL_THAN: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "b.gt {0}",
+        ),
+        Intrinsic.GREATER_THAN: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "b.le {0}",
+        ),
+        Intrinsic.GREATER_EQUAL_THAN: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X0, X1",
+            "b.lt {0}",
+        ),
+    },
+)
+
+# Functions with at most that amount of operators are expanded at call site (see `_collect_inlined_functions`)
+_INLINE_FUNCTION_MAX_OPERATORS = 6
+# Total amount of operators that expanding small functions is allowed to add
+_INLINE_MAX_GROWTH_OPERATORS = 1024
+_JUMP_OPERATOR_TYPES = frozenset(
+    (OperatorType.IF, OperatorType.WHILE, OperatorType.DO, OperatorType.END),
+)
+
+# Enum members that are compared within hot dispatch loop
+_DROP = Intrinsic.DROP
+_COPY = Intrinsic.COPY
+# Arguments count of syscalls (`None` for other intrinsics) indexed by intrinsic value
+_SYSCALL_ARGUMENTS_COUNT = _make_intrinsic_table(SYSCALL_ARGUMENTS_COUNT)
+# Shared (not mutated) injected arguments of syscall without any optimizations, indexed by arguments count
+_NOT_INJECTED_SYSCALL_ARGS = tuple(
+    (None,) * args_count for args_count in range(max(SYSCALL_ARGUMENTS_COUNT.values()) + 1)
+)
+
+_SP_POP_PREFIX = "\tadd SP, SP, #"
+_SP_PUSH_PREFIX = "\tsub SP, SP, #"
+_SP_ACCESS_PATTERN = re.compile(r"\[SP(?:, #(-?\d+))?\](?:(!)|, #(-?\d+))?")
+# Keep deferred displacement encodable as an immediate of `add` and load/store offsets
+_SP_MAX_DEFERRED_DISPLACEMENT = 4080
+_CONTROL_FLOW_MNEMONICS = frozenset(("b", "bl", "bne", "beq", "ret", "cbz", "cbnz"))
+_LABEL_BRANCH_MNEMONICS = frozenset(("b", "bne", "beq"))
+
+# Drop is not here as it only discards cached top of the stack (see `_write_drop`)
+_ARM64_INTRINSIC_TEMPLATES = _make_intrinsic_table(
+    {
+        Intrinsic.MEMORY_LOAD: _asm_block("ldr X0, [X0]"),
+        Intrinsic.MEMORY_STORE: _asm_block(
+            "ldr X1, [SP], #16",
+            "str X0, [X1]",
+            "mov X0, X1",
+        ),
+        Intrinsic.PLUS: _asm_block(
+            "ldr X1, [SP], #16",
+            "add X0, X1, X0",
+        ),
+        Intrinsic.MINUS: _asm_block(
+            "ldr X1, [SP], #16",
+            "sub X0, X1, X0",
+        ),
+        Intrinsic.COPY: _asm_block("str X0, [SP, #-16]!"),
+        Intrinsic.INCREMENT: _asm_block("add X0, X0, #1"),
+        Intrinsic.DECREMENT: _asm_block("sub X0, X0, #1"),
+        Intrinsic.MULTIPLY: _asm_block(
+            "ldr X1, [SP], #16",
+            "mul X0, X1, X0",
+        ),
+        Intrinsic.DIVIDE: _asm_block(
+            "ldr X1, [SP], #16",
+            "sdiv X0, X1, X0",
+        ),
+        Intrinsic.MODULUS: _asm_block(
+            "ldr X1, [SP], #16",
+            "udiv X2, X1, X0",
+            "msub X0, X2, X0, X1",
+        ),
+        Intrinsic.NOT_EQUAL: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "cset X0, ne",
+        ),
+        Intrinsic.GREATER_EQUAL_THAN: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X0, X1",
+            "cset X0, ge",
+        ),
+        Intrinsic.LESS_EQUAL_THAN: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "cset X0, le",
+        ),
+        Intrinsic.LESS_THAN: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "cset X0, lt",
+        ),
+        Intrinsic.GREATER_THAN: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "cset X0, gt",
+        ),
+        Intrinsic.EQUAL: _asm_block(
+            "ldr X1, [SP], #16",
+            "cmp X1, X0",
+            "cset X0, eq",
+        ),
+        Intrinsic.SWAP: _asm_block(
+            "ldr X1, [SP]",
+            "str X0, [SP]",
+            "mov X0, X1",
+        ),
+    },
+)
+
+
 def generate_ARM64_MacOS_backend(  # noqa: N802
     fd: IO[str],
     program_context: ProgramContext,
     *,
     debug_comments: bool,
 ) -> None:
-    context = CodegenContext(fd=fd)
+    labels, labels_over = _make_labels(program_context)
+    emitted_functions = _collect_emitted_functions(program_context)
+    context = CodegenContext(
+        inlined_functions=_collect_inlined_functions(program_context, emitted_functions),
+        extern_functions=program_context.extern_functions,
+        labels=labels,
+        labels_over=labels_over,
+    )
 
     if debug_comments:
         _write_debug_header_comment(context)
@@ -27,371 +235,685 @@ def generate_ARM64_MacOS_backend(  # noqa: N802
     _write_function_declarations(
         context,
         program_context,
+        emitted_functions,
         debug_comments=debug_comments,
     )
 
-    _write_entry_header(fd)
+    _write_entry_header(context)
 
     _write_executable_body_instruction_set(
-        fd,
         context,
         program_context.operators,
         program_context,
         debug_comments=debug_comments,
     )
     _write_program_epilogue(context, debug_comments=debug_comments)
+    _flush_block(context)
     _write_static_segment(context)
 
+    # Whole assembly is written at once, rather than with lots of small writes
+    fd.write("".join(context.buf))
+
 
 def _write_executable_body_instruction_set(
-    fd: IO[str],
     context: CodegenContext,
     operators: Sequence[Operator],
     program_context: ProgramContext,
     *,
     debug_comments: bool,
 ) -> None:
-    for idx, operator in enumerate(operators):
+    # Hot loop, attributes are looked up once into locals
+    block_append = context.block.append
+    labels = context.labels
+    labels_over = context.labels_over
+    operators_count = len(operators)
+
+    idx = 0
+    while idx < operators_count:
+        operator = operators[idx]
+        operand = operator.operand
+        jump_idx = operator.jumps_to_operator_idx
+        next_idx = idx + 1
+
         if debug_comments:
             _write_debug_operator_comment(context, operator)
 
         match operator.type:
+            case OperatorType.INTRINSIC:
+                assert isinstance(operand, Intrinsic)
+                if operand is _DROP:
+                    _write_drop(context)
+                elif operand is _COPY and not context.tos_in_reg:
+                    # Copy of top of the stack is only an load of it (without popping)
+                    block_append(_ARM64_PEEK_TOS)
+                    context.tos_in_reg = True
+                elif _SYSCALL_ARGUMENTS_COUNT[operand] is not None:
+                    _write_syscall_instruction_set(context, operator)
+                elif _is_compare_followed_by_condition(operators, idx):
+                    _write_compare_and_branch(context, operator, operators[next_idx])
+                    # Condition is consumed together with comparison
+                    next_idx += 1
+                else:
+                    _load_tos(context)
+                    block_append(_ARM64_INTRINSIC_TEMPLATES[operand])
+                    context.tos_in_reg = True
             case OperatorType.PUSH_INTEGER:
-                context.write(
-                    "sub SP, SP, #16",
-                    "mov X0, #%d" % operator.operand,
-                    "str X0, [SP]",
-                )
+                # Integer push may be followed by operators that are computable right now
+                value, next_idx = _fold_integer_operators(operators, idx)
+                _spill_tos(context)
+                block_append(_move_immediate("X0", value))
+                context.tos_in_reg = True
             case OperatorType.PUSH_STRING:
-                assert isinstance(operator.operand, str)
-
-                context.write(
-                    "sub SP, SP, #16",
-                    "adr X0, %s" % context.load_string(operator.token.text[1:-1]),
-                    "str X0, [SP]",
-                    "sub SP, SP, #16",
-                    "mov X0, #%d" % len(operator.operand),
-                    "str X0, [SP]",
+                assert isinstance(operand, str)
+                _spill_tos(context)
+                context.tos_in_reg = True
+                block_append(
+                    _ARM64_PUSH_STRING_TEMPLATE.format(context.load_string(operator.token.text[1:-1])),
                 )
-            case OperatorType.DO:
-                assert isinstance(operator.jumps_to_operator_idx, int)
-                context.write(
-                    "ldr X0, [SP]",
-                    "add SP, SP, #16",
-                    "cmp X0, #1",
-                    "bne .ctx_%s_over" % operator.jumps_to_operator_idx,
+                block_append(_move_immediate("X0", len(operand)))
+            case OperatorType.IF | OperatorType.DO:
+                assert isinstance(jump_idx, int)
+                _load_tos(context)
+                context.tos_in_reg = False
+                block_append(
+                    _ARM64_OPERATOR_TEMPLATES[operator.type].format(
+                        labels_over[jump_idx] if operator.type == OperatorType.DO else labels[jump_idx],
+                    ),
                 )
             case OperatorType.END | OperatorType.WHILE:
-                if isinstance(operator.jumps_to_operator_idx, int):
-                    context.write(
-                        "b .ctx_%s" % operator.jumps_to_operator_idx,
-                    )
-                    fd.write(f".ctx_{idx}_over:\n")
+                if jump_idx is not None:
+                    _spill_tos(context)
+                    block_append(_ARM64_LOOP_BACK_TEMPLATE.format(labels[jump_idx]))
+                    _write_label(context, labels_over[idx])
                 else:
-                    fd.write(f".ctx_{idx}:\n")
-            case OperatorType.IF:
-                assert isinstance(operator.jumps_to_operator_idx, int)
-                context.write(
-                    "ldr X0, [SP]",
-                    "add SP, SP, #16",
-                    "cmp X0, #1",
-                    "bne .ctx_%s" % operator.jumps_to_operator_idx,
-                )
-            case OperatorType.INTRINSIC:
-                assert isinstance(operator.operand, Intrinsic)
-                match operator.operand:
-                    case Intrinsic.MEMORY_LOAD:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "ldr X1, [X0]",
-                            "str X1, [SP]",
-                        )
-                    case Intrinsic.MEMORY_STORE:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X1, [SP]",
-                            "str X0, [X1]",
-                        )
-                    case Intrinsic.DROP:
-                        context.write("add SP, SP, #16")
-                    case (
-                        Intrinsic.SYSCALL0
-                        | Intrinsic.SYSCALL1
-                        | Intrinsic.SYSCALL2
-                        | Intrinsic.SYSCALL3
-                        | Intrinsic.SYSCALL4
-                        | Intrinsic.SYSCALL5
-                        | Intrinsic.SYSCALL6
-                    ):
-                        syscall_arguments = operator.get_syscall_arguments_count()
-                        injected_args = operator.syscall_optimization_injected_args or [
-                            None for _ in range(syscall_arguments)
-                        ]
-
-                        if injected_args[-1] is None:
-                            context.write(
-                                "ldr X16, [SP]",
-                                "add SP, SP, #16",
-                            )
-                        else:
-                            context.write("mov X16, #%d" % injected_args[-1])
-
-                        injected_args.pop()
-
-                        for arg_n in range(syscall_arguments - 1):
-                            # Load register in reversed order of stack so top of the stack is max register
-                            arg_register = syscall_arguments - arg_n - 2
-
-                            injected_arg = injected_args[-arg_n] if arg_n else None
-                            if injected_arg is None:
-                                context.write("ldr X%s, [SP]" % arg_register)
-                                context.write("add SP, SP, #16")
-                            else:
-                                context.write(
-                                    "mov X%s, #%d" % (arg_register, injected_arg),
-                                )
-                        context.write("svc #0")
-
-                        if not operator.syscall_optimization_omit_result:
-                            # Do not store result on stack if optimization is applied for omitting result
-                            # this occurs when result drops after syscall
-                            context.write(
-                                "sub SP, SP, #16",
-                                "str X0, [SP]",
-                            )
-                    case Intrinsic.PLUS:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "add X0, X1, X0",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.MINUS:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "sub X0, X1, X0",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.COPY:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "str X0, [SP]",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.INCREMENT:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "add X0, X0, #1",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.DECREMENT:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "sub X0, X0, #1",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.MULTIPLY:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "mul X0, X1, X0",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.DIVIDE:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "sdiv X0, X1, X0",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.MODULUS:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "udiv X2, X1, X0",
-                            "mul X2, X2, X0",
-                            "sub X0, X1, X2",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.NOT_EQUAL:
-                        context.write(
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "cmp X0, X1",
-                            "cset X0, ne",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.GREATER_EQUAL_THAN:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "cmp X0, X1",
-                            "cset X0, ge",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.LESS_EQUAL_THAN:
-                        context.write(
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "cmp X0, X1",
-                            "cset X0, le",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.LESS_THAN:
-                        context.write(
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "cmp X0, X1",
-                            "cset X0, lt",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.GREATER_THAN:
-                        context.write(
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "cmp X0, X1",
-                            "cset X0, gt",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.EQUAL:
-                        context.write(
-                            "ldr X1, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "cmp X0, X1",
-                            "cset X0, eq",
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                    case Intrinsic.SWAP:
-                        context.write(
-                            "ldr X0, [SP]",
-                            "add SP, SP, #16",
-                            "ldr X1, [SP]",
-                            "str X0, [SP]",
-                            "sub SP, SP, #16",
-                            "str X1, [SP]",
-                        )
+                    _write_label(context, labels[idx])
             case OperatorType.CALL:
-                assert isinstance(operator.operand, str)
-
-                function_name = operator.operand
-                if function_name in program_context.functions:
-                    function = program_context.functions[function_name]
-                    if function.is_externally_defined:
-                        for arg_register in range(
-                            len(function.type_contract_in) - 1,
-                            -1,
-                            -1,
-                        ):
-                            context.write("ldr X%s, [SP]" % arg_register)
-                            context.write("add SP, SP, #16")
-                    context.write("bl %s" % function_name)
-                    if function.type_contract_out:
-                        context.write(
-                            "sub SP, SP, #16",
-                            "str X0, [SP]",
-                        )
-                elif function_name in getattr(program_context, 'extern_functions', set()):
-                    # MVP: только один аргумент (X0), можно расширить
-                    context.write("ldr X0, [SP]")
-                    context.write("add SP, SP, #16")
-                    context.write("bl %s" % function_name)
-                    context.write("sub SP, SP, #16")
-                    context.write("str X0, [SP]")
-                else:
-                    raise KeyError(function_name)
+                _write_call_instruction_set(
+                    context,
+                    operator,
+                    program_context,
+                    debug_comments=debug_comments,
+                )
             case _:
                 raise NotImplementedError(
                     "Operator %s is not implemented in ARM64 MacOS backend"
                     % operator.type.name,
                 )
 
+        idx = next_idx
+
+
+def _fold_integer_operators(operators: Sequence[Operator], idx: int) -> tuple[int, int]:
+    """Fold integer push at given index with following operators that are computable at compile time.
+
+    (e.g `3 4 +` or `3 inc`), so they are emitted as single push.
+    Returns folded value and index of the first operator that was not folded.
+    Operands are folded as signed 64 bit integers, as they are at runtime.
+    """
+    value = operators[idx].operand
+    assert isinstance(value, int)
+    if not _INT64_MIN <= value <= _UINT64_MAX:
+        # Not representable at all, reported when it is moved into register
+        return value, idx + 1
+    value = _to_int64(value)
+
+    idx += 1
+    while idx < len(operators):
+        operator = operators[idx]
+        if operator.type != OperatorType.INTRINSIC:
+            if (
+                operator.type != OperatorType.PUSH_INTEGER
+                or idx + 1 >= len(operators)
+                or operators[idx + 1].type != OperatorType.INTRINSIC
+            ):
+                break
+
+            fold_binary = _BINARY_INTRINSIC_FOLDS[operators[idx + 1].operand]  # type: ignore[arg-type]
+            rhs = operator.operand
+            assert isinstance(rhs, int)
+            if fold_binary is None or not _INT64_MIN <= rhs <= _UINT64_MAX:
+                break
+            folded = fold_binary(value, _to_int64(rhs))
+            step = 2
+        else:
+            delta = _UNARY_INTRINSIC_FOLDS[operator.operand]  # type: ignore[arg-type]
+            folded = None if delta is None else value + delta
+            step = 1
+
+        if folded is None or not _INT64_MIN <= folded <= _INT64_MAX:
+            break
+        value = folded
+        idx += step
+    return value, idx
+
+
+def _to_int64(value: int) -> int:
+    """Reinterpret unsigned 64 bit value as signed one (same bits within register)."""
+    return value - _UINT64_MAX - 1 if value > _INT64_MAX else value
+
+
+def _fold_divide(lhs: int, rhs: int) -> int | None:
+    if rhs == 0:
+        return None
+    # `sdiv` truncates towards zero while Python floors
+    quotient = abs(lhs) // abs(rhs)
+    return quotient if (lhs < 0) == (rhs < 0) else -quotient
+
+
+def _fold_modulus(lhs: int, rhs: int) -> int | None:
+    # Modulus is emitted with unsigned division, so only fold where it is same as Python one
+    if lhs < 0 or rhs <= 0:
+        return None
+    return lhs % rhs
+
+
+# Compile time folding of operators that follows integer push
+# Folds must produce same result as emitted instructions (or None when not foldable)
+_BINARY_INTRINSIC_FOLDS: list[Callable[[int, int], int | None] | None] = _make_intrinsic_table(
+    {
+        Intrinsic.PLUS: python_operator.add,
+        Intrinsic.MINUS: python_operator.sub,
+        Intrinsic.MULTIPLY: python_operator.mul,
+        Intrinsic.DIVIDE: _fold_divide,
+        Intrinsic.MODULUS: _fold_modulus,
+    },
+)
+_UNARY_INTRINSIC_FOLDS = _make_intrinsic_table(
+    {
+        Intrinsic.INCREMENT: 1,
+        Intrinsic.DECREMENT: -1,
+    },
+)
+_INT64_MIN = -(2**63)
+_INT64_MAX = 2**63 - 1
+_UINT64_MAX = 2**64 - 1
+
+
+def _move_immediate(register: str, value: int) -> str:
+    """Make instructions that moves 64 bit immediate value into register.
+
+    Immediate that does not fit into single move is split into 16 bit chunks:
+    first chunk is moved with `movz` (or `movn` if most of chunks are all ones, e.g negative values)
+    and rest of chunks that differs are inserted with `movk`.
+    """
+    if _ARM64_MOVE_IMMEDIATE_MIN <= value <= _ARM64_MOVE_IMMEDIATE_MAX:
+        return _ARM64_MOVE_IMMEDIATE_TEMPLATE.format(register, value)
+    if not _INT64_MIN <= value <= _UINT64_MAX:
+        raise CodegenIntegerOutOfRangeError(value=value)
+    if value > _INT64_MAX:
+        # Unsigned value has same bits as the negative one (which may fit into single move)
+        return _move_immediate(register, value - _UINT64_MAX - 1)
+
+    bits = value & _UINT64_MAX
+    chunks = [(bits >> shift) & 0xFFFF for shift in range(0, 64, 16)]
+    inverted = chunks.count(0xFFFF) > chunks.count(0)
+    # Chunks which are already set by first move
+    implicit_chunk = 0xFFFF if inverted else 0
+
+    instructions: list[str] = []
+    for chunk_n, chunk in enumerate(chunks):
+        if chunk == implicit_chunk:
+            continue
+        if instructions:
+            instructions.append("movk %s, #%d, lsl #%d" % (register, chunk, chunk_n * 16))
+        elif inverted:
+            inverted_chunk = chunk ^ 0xFFFF
+            instructions.append("movn %s, #%d, lsl #%d" % (register, inverted_chunk, chunk_n * 16))
+        else:
+            instructions.append("movz %s, #%d, lsl #%d" % (register, chunk, chunk_n * 16))
+    return _asm_block(*instructions)
+
+
+def _is_compare_followed_by_condition(operators: Sequence[Operator], idx: int) -> bool:
+    return (
+        _ARM64_COMPARE_AND_BRANCH_TEMPLATES[operators[idx].operand] is not None  # type: ignore[index]
+        and idx + 1 < len(operators)
+        and operators[idx + 1].type in _CONDITION_OPERATOR_TYPES
+    )
+
+
+def _write_compare_and_branch(
+    context: CodegenContext,
+    compare_operator: Operator,
+    condition_operator: Operator,
+) -> None:
+    """Write comparison that is directly consumed by condition (`if`/`do`).
+
+    Branches on comparison flags rather than materializing boolean onto stack and testing it afterwards.
+    """
+    assert isinstance(compare_operator.operand, Intrinsic)
+    assert isinstance(condition_operator.jumps_to_operator_idx, int)
+    labels = context.labels_over if condition_operator.type == OperatorType.DO else context.labels
+    label = labels[condition_operator.jumps_to_operator_idx]
+    template = _ARM64_COMPARE_AND_BRANCH_TEMPLATES[compare_operator.operand]
+    assert template is not None
+    _load_tos(context)
+    context.tos_in_reg = False
+    context.block.append(template.format(label))
+
+
+def _write_syscall_instruction_set(
+    context: CodegenContext,
+    operator: Operator,
+) -> None:
+    assert isinstance(operator.operand, Intrinsic)
+    syscall_arguments = _SYSCALL_ARGUMENTS_COUNT[operator.operand]
+    assert syscall_arguments is not None
+    # Injected arguments are in stack order (syscall number is the last one)
+    # so argument for register Xn is at index n
+    injected_args = (
+        operator.syscall_optimization_injected_args
+        or _NOT_INJECTED_SYSCALL_ARGS[syscall_arguments]
+    )
+    if injected_args[0] is not None:
+        # Every argument is injected (injected ones are always top of the stack),
+        # so cached top of the stack is not consumed and must be spilled before X0 is overwritten
+        _spill_tos(context)
+
+    syscall_number = injected_args[-1]
+    if syscall_number is None:
+        _pop_into_register(context, "X16")
+    else:
+        context.block.append(_move_immediate("X16", syscall_number))
+
+    # Load register in reversed order of stack so top of the stack is max register
+    for arg_register in range(syscall_arguments - 2, -1, -1):
+        injected_arg = injected_args[arg_register]
+        if injected_arg is None:
+            _pop_into_register(context, "X%s" % arg_register)
+        else:
+            context.block.append(_move_immediate("X%s" % arg_register, injected_arg))
+    _spill_tos(context)
+    context.write("svc #0")
+
+    # Do not push result on stack if optimization is applied for omitting result
+    # this occurs when result drops after syscall
+    context.tos_in_reg = not operator.syscall_optimization_omit_result
+
+
+def _write_call_instruction_set(
+    context: CodegenContext,
+    operator: Operator,
+    program_context: ProgramContext,
+    *,
+    debug_comments: bool,
+) -> None:
+    assert isinstance(operator.operand, str)
+
+    function_name = operator.operand
+    if function_name in context.inlined_functions:
+        # Expand body of the function right at call site instead of calling it
+        _write_executable_body_instruction_set(
+            context,
+            program_context.functions[function_name].source,
+            program_context,
+            debug_comments=debug_comments,
+        )
+    elif function_name in program_context.functions:
+        function = program_context.functions[function_name]
+        if function.is_externally_defined:
+            for arg_register in range(
+                len(function.type_contract_in) - 1,
+                -1,
+                -1,
+            ):
+                _pop_into_register(context, "X%s" % arg_register)
+        _spill_tos(context)
+        context.write("bl %s" % function_name)
+        # Function with return contract returns its top of the stack (which is left onto stack as-is)
+        # in X0, so it is pushed once more as new top of the stack
+        context.tos_in_reg = bool(function.type_contract_out)
+    elif function_name in context.extern_functions:
+        # MVP: только один аргумент (X0), можно расширить
+        _pop_into_register(context, "X0")
+        context.write("bl %s" % function_name)
+        context.tos_in_reg = True
+    else:
+        raise KeyError(function_name)
+
+
+def _spill_tos(context: CodegenContext) -> None:
+    """Store top of the stack cached in X0 onto stack (if it is cached)."""
+    if context.tos_in_reg:
+        context.block.append(_ARM64_SPILL_TOS)
+        context.tos_in_reg = False
+
+
+def _load_tos(context: CodegenContext) -> None:
+    """Pop top of the stack into X0 (if it is not cached already)."""
+    if not context.tos_in_reg:
+        context.block.append(_ARM64_LOAD_TOS)
+        context.tos_in_reg = True
+
+
+def _pop_into_register(context: CodegenContext, register: str) -> None:
+    if not context.tos_in_reg:
+        context.block.append("\tldr %s, [SP], #16\n" % register)
+        return
+    if register != "X0":
+        context.block.append("\tmov %s, X0\n" % register)
+    context.tos_in_reg = False
+
+
+def _write_drop(context: CodegenContext) -> None:
+    if context.tos_in_reg:
+        context.tos_in_reg = False
+        return
+    context.block.append(_ARM64_DROP)
+
 
 def _write_debug_operator_comment(context: CodegenContext, operator: Operator) -> None:
-    location = operator.token.location
+    """Write comment describing operator, only used when debug comments are requested.
 
+    Whole comment is formatted at once, as this is called for every operator in that case.
+    """
     if operator.type == OperatorType.INTRINSIC:
         assert isinstance(operator.operand, Intrinsic)
-        comment = "// * Intrinsic %s" % operator.operand.name
+        kind, name = "Intrinsic", operator.operand.name
     else:
-        comment = "// * Operator %s" % operator.type.name
-    comment += " from %s" % location
-    if operator.has_optimizations:
-        if operator.is_syscall():
-            comment += " [optimized, omit result: %s, injected args: %s]" % (
-                operator.syscall_optimization_omit_result,
-                operator.syscall_optimization_injected_args,
-            )
-        else:
-            comment += " [optimized, infer type: %s]" % (
-                operator.infer_type_after_optimization.name
-                if operator.infer_type_after_optimization
-                else "as-is"
-            )
+        kind, name = "Operator", operator.type.name
+
+    context.block.append(
+        _ARM64_DEBUG_OPERATOR_COMMENT_TEMPLATE.format(
+            kind,
+            name,
+            operator.token.location,
+            _describe_operator_optimizations(operator) if operator.has_optimizations else "",
+        ),
+    )
 
-    context.write(comment)
+
+def _describe_operator_optimizations(operator: Operator) -> str:
+    if operator.is_syscall():
+        return " [optimized, omit result: %s, injected args: %s]" % (
+            operator.syscall_optimization_omit_result,
+            operator.syscall_optimization_injected_args,
+        )
+    return " [optimized, infer type: %s]" % (
+        operator.infer_type_after_optimization.name
+        if operator.infer_type_after_optimization
+        else "as-is"
+    )
 
 
 def _write_function_declarations(
     context: CodegenContext,
     program_context: ProgramContext,
+    emitted_functions: Sequence[Function],
     *,
     debug_comments: bool,
 ) -> None:
-    for function in filter(
-        lambda f: not f.emit_inline_body and not f.is_externally_defined,
-        program_context.functions.values(),
-    ):
-        context.fd.write("%s:\n" % function.name)
+    for function in emitted_functions:
+        if function.name in context.inlined_functions:
+            # Every call is expanded, so function itself is never called
+            continue
+
+        _write_label(context, function.name)
         _write_executable_body_instruction_set(
-            context.fd,
             context,
             function.source,
             program_context,
             debug_comments=debug_comments,
         )
+        if function.type_contract_out and not context.tos_in_reg:
+            # Returned value is top of the stack, so it must be within X0 even if it is not cached
+            context.block.append(_ARM64_PEEK_TOS)
+        _spill_tos(context)
         context.write("ret")
+    _flush_block(context)
+
+
+def _collect_emitted_functions(program_context: ProgramContext) -> list[Function]:
+    """Collect functions which bodies are emitted by backend.
+
+    Inline functions are already expanded by parser and extern functions are linked, so both are skipped.
+    """
+    return [
+        function
+        for function in program_context.functions.values()
+        if not function.emit_inline_body and not function.is_externally_defined
+    ]
+
+
+def _collect_inlined_functions(
+    program_context: ProgramContext,
+    emitted_functions: Sequence[Function],
+) -> frozenset[str]:
+    """Collect functions which calls are expanded with body of the function rather than being called.
+
+    Function is expanded only if its body has no jumps (labels of expanded body would clash between call sites)
+    and it does not recurse into itself. Then it is expanded either if it is small or it is called only once.
+    Size is measured with calls inside of the body already expanded (so nested expansions does not grow
+    exponentially) and total growth of expanded bodies is limited. Function called only once is expanded
+    only when its caller is not expanded itself (otherwise it would be expanded at every call site of the caller).
+    Functions with return contract are always called, as call pushes returned X0 onto stack after return.
+    """
+    # Caller is `None` for calls from the program body itself
+    callers: dict[str, list[str | None]] = defaultdict(list)
+    for caller, source in (
+        (None, program_context.operators),
+        *((function.name, function.source) for function in emitted_functions),
+    ):
+        for operator in source:
+            if operator.type == OperatorType.CALL:
+                assert isinstance(operator.operand, str)
+                callers[operator.operand].append(caller)
+
+    candidates = {
+        function.name: function
+        for function in emitted_functions
+        if not function.type_contract_out
+        and not any(operator.type in _JUMP_OPERATOR_TYPES for operator in function.source)
+    }
+    candidates = {
+        name: function
+        for name, function in candidates.items()
+        if not _is_recursive_function(name, candidates)
+    }
+
+    # Callees are ordered before their callers (there is no cycles as recursive functions are dropped)
+    order = list(
+        TopologicalSorter(
+            {name: _collect_callees(function, candidates) for name, function in candidates.items()},
+        ).static_order(),
+    )
+
+    inlined: set[str] = set()
+    expanded_sizes: dict[str, int] = {}
+    growth_budget = _INLINE_MAX_GROWTH_OPERATORS
+    for name in order:
+        expanded_size = sum(
+            expanded_sizes[operator.operand]  # type: ignore[index]
+            if operator.type == OperatorType.CALL and operator.operand in inlined
+            else 1
+            for operator in candidates[name].source
+        )
+        expanded_sizes[name] = expanded_size
+        # Each call (single operator) is replaced with expanded body
+        growth = (expanded_size - 1) * len(callers[name])
+        if expanded_size <= _INLINE_FUNCTION_MAX_OPERATORS and growth <= growth_budget:
+            inlined.add(name)
+            growth_budget -= growth
+
+    # Callers are ordered first, so it is already known whether caller is expanded
+    for name in reversed(order):
+        if name not in inlined and len(callers[name]) == 1 and callers[name][0] not in inlined:
+            inlined.add(name)
+    return frozenset(inlined)
+
+
+def _collect_callees(function: Function, functions: Collection[str]) -> set[str]:
+    """Collect functions from given ones that are called within body of the function."""
+    return {
+        operator.operand  # type: ignore[misc]
+        for operator in function.source
+        if operator.type == OperatorType.CALL and operator.operand in functions
+    }
+
+
+def _is_recursive_function(name: str, functions: Mapping[str, Function]) -> bool:
+    """Check is function calls itself (directly or through given functions)."""
+    visited: set[str] = set()
+    pending = [name]
+    while pending:
+        for operator in functions[pending.pop()].source:
+            callee = operator.operand
+            if operator.type != OperatorType.CALL or callee not in functions:
+                continue
+            assert isinstance(callee, str)
+            if callee == name:
+                return True
+            if callee not in visited:
+                visited.add(callee)
+                pending.append(callee)
+    return False
+
+
+def _make_labels(program_context: ProgramContext) -> tuple[list[str], list[str]]:
+    """Make labels for jump targets (`.ctx_<idx>`) and loop exits (`.ctx_<idx>_over`) indexed by operator index.
+
+    Formatted once for operator index within any body (program itself or function) rather than per jump.
+    """
+    labels_count = max(
+        (len(program_context.operators), *(len(f.source) for f in program_context.functions.values())),
+    )
+    labels = [".ctx_%d" % idx for idx in range(labels_count)]
+    return labels, [label + "_over" for label in labels]
+
+
+def _write_label(context: CodegenContext, label: str) -> None:
+    """Write label which is an block boundary (jump target) so current block must be flushed first."""
+    _spill_tos(context)
+    _flush_block(context, layout_successor=label)
+    context.buf.append(label + ":\n")
+
+
+def _flush_block(context: CodegenContext, *, layout_successor: str | None = None) -> None:
+    """Write instructions of current basic block with peephole optimizations applied.
+
+    Layout successor is label placed right after that block, branch into it is redundant.
+    """
+    if not context.block:
+        return
+    instructions = "".join(context.block).splitlines()
+    context.block.clear()
+    if layout_successor is not None:
+        _drop_branch_into_layout_successor(instructions, layout_successor)
+    context.buf.append("\n".join(_peephole_fuse_sp(instructions)) + "\n")
+
+
+def _peephole_fuse_sp(instructions: Sequence[str]) -> list[str]:
+    """Fuse stack pointer adjustments within single basic block.
+
+    Pop (`add SP`) followed by push (`sub SP` or pre-indexed store) cancels out, so pops are deferred
+    and stack pointer relative accesses are displaced by deferred amount instead.
+    Deferred displacement is materialized before control flow and at the end of the block.
+    Stack pointer is only deferred upwards so nothing is ever stored below it.
+    """
+    fused: list[str] = []
+    displacement = 0
+    for instruction in instructions:
+        if instruction.startswith(_SP_POP_PREFIX):
+            adjustment = int(instruction[len(_SP_POP_PREFIX) :])
+            if displacement + adjustment > _SP_MAX_DEFERRED_DISPLACEMENT:
+                # Deferring it would make displacement not encodable, so pop is kept as-is
+                if displacement:
+                    fused.append(_SP_POP_PREFIX + str(displacement))
+                    displacement = 0
+                fused.append(instruction)
+            else:
+                displacement += adjustment
+            continue
+        if instruction.startswith(_SP_PUSH_PREFIX):
+            adjustment = int(instruction[len(_SP_PUSH_PREFIX) :])
+            if adjustment > displacement:
+                fused.append(_SP_PUSH_PREFIX + str(adjustment - displacement))
+                displacement = 0
+            else:
+                displacement -= adjustment
+            continue
+        if displacement:
+            if "[SP" in instruction:
+                displaced_instruction, displaced_by = _displace_sp_access(instruction, displacement)
+                if displaced_by > _SP_MAX_DEFERRED_DISPLACEMENT:
+                    # Same as for pops, writeback is kept as-is after materializing displacement
+                    fused.append(_SP_POP_PREFIX + str(displacement))
+                    fused.append(instruction)
+                    displacement = 0
+                else:
+                    fused.append(displaced_instruction)
+                    displacement = displaced_by
+                continue
+            if _is_control_flow_instruction(instruction):
+                fused.append(_SP_POP_PREFIX + str(displacement))
+                displacement = 0
+        fused.append(instruction)
+
+    if displacement:
+        fused.append(_SP_POP_PREFIX + str(displacement))
+    return fused
+
+
+def _displace_sp_access(instruction: str, displacement: int) -> tuple[str, int]:
+    """Rewrite stack pointer relative access as if stack pointer was already adjusted by displacement.
+
+    Writeback (pre/post-indexed) is folded into displacement, returns rewritten instruction and new displacement.
+    """
+    access = _SP_ACCESS_PATTERN.search(instruction)
+    assert access is not None, instruction
+    offset, is_pre_indexed, post_index = access.groups()
+
+    address = displacement + int(offset or 0)
+    if is_pre_indexed:
+        displacement = address
+    elif post_index:
+        displacement += int(post_index)
+
+    if displacement < 0:
+        # Push below current stack pointer, must be materialized as writeback
+        operand = "[SP, #%d]!" % address
+        displacement = 0
+    else:
+        operand = "[SP, #%d]" % address if address else "[SP]"
+    return instruction[: access.start()] + operand + instruction[access.end() :], displacement
+
+
+def _drop_branch_into_layout_successor(instructions: list[str], layout_successor: str) -> None:
+    """Drop last branch of the block if it jumps to label which block falls through into anyway.
+
+    Comparison that sets flags only for that (conditional) branch is dead after that, so it is dropped too.
+    """
+    positions = _instruction_positions_backwards(instructions)
+    position = next(positions, None)
+    if position is None:
+        return
+    mnemonic, _, target = instructions[position].lstrip().partition(" ")
+    if target != layout_successor or not (mnemonic in _LABEL_BRANCH_MNEMONICS or mnemonic.startswith("b.")):
+        return
+    del instructions[position]
+    if mnemonic == "b":
+        return
+    position = next(positions, None)
+    if position is not None and instructions[position].lstrip().startswith("cmp "):
+        del instructions[position]
+
+
+def _instruction_positions_backwards(instructions: Sequence[str]) -> Iterator[int]:
+    """Yield positions of instructions from the end, skipping comments."""
+    for position in range(len(instructions) - 1, -1, -1):
+        if not instructions[position].lstrip().startswith("//"):
+            yield position
+
+
+def _is_control_flow_instruction(instruction: str) -> bool:
+    mnemonic = instruction.lstrip().partition(" ")[0]
+    return mnemonic in _CONTROL_FLOW_MNEMONICS or mnemonic.startswith("b.")
 
 
 def _write_debug_header_comment(context: CodegenContext) -> None:
-    context.fd.write("// Assembly generated by Gofra codegen backend\n\n")
-    context.fd.write("// Generated at: %s\n" % datetime.now(tz=None))  # noqa: DTZ005
-    context.fd.write("// Target: ARM64, MacOS\n\n")
+    context.buf.append("// Assembly generated by Gofra codegen backend\n\n")
+    context.buf.append("// Generated at: %s\n" % datetime.now(tz=None))  # noqa: DTZ005
+    context.buf.append("// Target: ARM64, MacOS\n\n")
 
 
 def _write_program_epilogue(context: CodegenContext, *, debug_comments: bool) -> None:
@@ -409,15 +931,17 @@ def _write_program_epilogue(context: CodegenContext, *, debug_comments: bool) ->
 
 
 def _write_static_segment(context: CodegenContext) -> None:
-    context.fd.write("mem_buffer: .space 1000\n")
-    if not context.strings:
-        return
-
-    for string_key, string_value in context.strings.items():
-        context.fd.write(f'{string_key}: .string "{string_value}"\n')
+    # Whole segment is appended as single chunk rather than chunk per each string
+    context.buf.append(
+        "mem_buffer: .space 1000\n"
+        + "".join(
+            f'{string_key}: .string "{string_value}"\n'
+            for string_key, string_value in context.strings.items()
+        ),
+    )
 
 
-def _write_entry_header(fd: IO[str]) -> None:
-    fd.write(".global _start\n")
-    fd.write(".align 4\n\n")
-    fd.write("_start:\n")
+def _write_entry_header(context: CodegenContext) -> None:
+    context.buf.append(".global _start\n")
+    context.buf.append(".align 4\n\n")
+    context.buf.append("_start:\n")
@@ -19,3 +19,20 @@ class CodegenUnsupportedBackendTargetPairError(GofraError):
 Unsupported backend target pair ({self.architecture.name} x {self.operating_system.name})!
 Please read documentation to find available target pairs!
 """
+
+
+class CodegenIntegerOutOfRangeError(GofraError):
+    def __init__(
+        self,
+        *args: object,
+        value: int,
+    ) -> None:
+        super().__init__(*args)
+        self.value = value
+
+    def __repr__(self) -> str:
+        return f"""Code generation failed
+
+Integer {self.value} does not fit into 64 bit register!
+Integers must be within signed or unsigned 64 bit range (possibly after constant folding)
+"""
@@ -34,6 +34,17 @@ class Intrinsic(IntEnum):
     SWAP = auto()
 
 
+# Syscall number is also taken from the stack, so `syscallN` takes N + 1 arguments
+SYSCALL_ARGUMENTS_COUNT: dict[Intrinsic, int] = {
+    Intrinsic.SYSCALL0: 1,
+    Intrinsic.SYSCALL1: 2,
+    Intrinsic.SYSCALL2: 3,
+    Intrinsic.SYSCALL3: 4,
+    Intrinsic.SYSCALL4: 5,
+    Intrinsic.SYSCALL5: 6,
+    Intrinsic.SYSCALL6: 7,
+}
+
 WORD_TO_INTRINSIC = {
     "+": Intrinsic.PLUS,
     "-": Intrinsic.MINUS,
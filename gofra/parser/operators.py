@@ -4,7 +4,7 @@ from dataclasses import dataclass, field
 from enum import IntEnum, auto
 from typing import TYPE_CHECKING
 
-from .intrinsics import Intrinsic
+from .intrinsics import SYSCALL_ARGUMENTS_COUNT, Intrinsic
 
 if TYPE_CHECKING:
     from gofra.lexer import Token
@@ -58,4 +58,4 @@ class Operator:
     def get_syscall_arguments_count(self) -> int:
         assert self.is_syscall()
         assert isinstance(self.operand, Intrinsic)
-        return int(self.operand.name[-1]) + 1
+        return SYSCALL_ARGUMENTS_COUNT[self.operand]
@@ -1,5 +1,6 @@
-from collections.abc import MutableSequence
-from dataclasses import dataclass
+from array import array
+from collections.abc import Collection
+from dataclasses import dataclass, field
 
 from gofra.parser.operators import Operator
 
@@ -14,11 +15,14 @@ from .types import GofraType
 class TypecheckContext:
     """Context for type checking which only required from internal usages."""
 
-    operators: MutableSequence[Operator]
+    # Types are stored as raw values of `GofraType` (compared as plain integers)
+    # and converted back into `GofraType` only when type itself is required
+    emulated_stack_types: array[int] = field(default_factory=lambda: array("b"))
 
-    emulated_stack_types: MutableSequence[GofraType]
+    # Functions that are defined outside and linked (looked up once, not per each call)
+    extern_functions: Collection[str] = field(default_factory=frozenset)
 
-    def push_types(self, *types: GofraType) -> None:
+    def push_types(self, *types: int) -> None:
         self.emulated_stack_types.extend(types)
 
     def raise_for_enough_arguments(
@@ -30,27 +34,27 @@ class TypecheckContext:
         if stack_size < required_args:
             raise TypecheckNotEnoughArgumentsError(
                 operator=operator,
-                types_on_stack=self.emulated_stack_types,
+                types_on_stack=[GofraType(t) for t in self.emulated_stack_types],
                 required_args=required_args,
             )
 
     def pop_argument_type(self) -> GofraType:
-        return self.emulated_stack_types.pop()
+        return GofraType(self.emulated_stack_types.pop())
 
     def pop_and_raise_for_argument_type(
         self,
         expected_type: GofraType,
         operator: Operator,
-    ) -> GofraType:
-        arg_type = self.pop_argument_type()
+    ) -> int:
+        arg_type = self.emulated_stack_types.pop()
         if arg_type != expected_type:
             raise TypecheckInvalidArgumentTypeError(
                 expected_type=expected_type,
-                actual_type=arg_type,
+                actual_type=GofraType(arg_type),
                 operator=operator,
             )
         return arg_type
 
     def consume_n_arguments(self, args_to_consume: int) -> None:
-        for _ in range(args_to_consume):
-            self.pop_argument_type()
+        if args_to_consume:
+            del self.emulated_stack_types[-args_to_consume:]
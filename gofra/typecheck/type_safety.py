@@ -1,206 +1,297 @@
-from collections import deque
-from collections.abc import Sequence
+from collections.abc import Callable, Mapping, Sequence
+from enum import IntEnum
 
 from gofra.context import ProgramContext
 from gofra.parser import Operator, OperatorType
-from gofra.parser.intrinsics import Intrinsic
+from gofra.parser.intrinsics import SYSCALL_ARGUMENTS_COUNT, Intrinsic
 
 from ._context import TypecheckContext
 from .exceptions import (
+    TypecheckInvalidArgumentTypeError,
     TypecheckInvalidBinaryMathArithmeticsError,
     TypecheckInvalidPointerArithmeticsError,
     TypecheckNonEmptyStackAtEndError,
 )
 from .types import GofraType
 
+type _Handler = Callable[[TypecheckContext, ProgramContext, Operator], None]
+
+# Raw values of types as they are stored within emulated stack
+_INTEGER = GofraType.INTEGER.value
+_POINTER = GofraType.POINTER.value
+_BOOLEAN = GofraType.BOOLEAN.value
+
 
 def validate_type_safety(
     program_context: ProgramContext,
     operators: Sequence[Operator],
 ) -> None:
-    context = TypecheckContext(operators=deque(operators), emulated_stack_types=[])
+    context = TypecheckContext(
+        extern_functions=program_context.extern_functions,
+    )
 
+    # Hot loop, handler tables are looked up once into locals
+    operator_handlers = _OPERATOR_HANDLERS
+    intrinsic_handlers = _INTRINSIC_HANDLERS
     for operator in operators:
-        match operator.type:
-            case OperatorType.WHILE | OperatorType.END:
-                ...
-            case OperatorType.PUSH_INTEGER:
-                push_type = GofraType.INTEGER
-
-                if (
-                    operator.has_optimizations
-                    and operator.infer_type_after_optimization
-                ):
-                    push_type = operator.infer_type_after_optimization
-
-                context.push_types(push_type)
-            case OperatorType.PUSH_STRING:
-                context.push_types(GofraType.POINTER, GofraType.INTEGER)
-            case OperatorType.INTRINSIC:
-                assert isinstance(operator.operand, Intrinsic)
-                match operator.operand:
-                    case Intrinsic.MEMORY_STORE:
-                        context.raise_for_enough_arguments(operator, required_args=2)
-                        # context.pop_and_raise_for_argument_type(
-                        #    GofraType.POINTER,
-                        #    operator=operator,
-                        # )
-                        # context.pop_and_raise_for_argument_type(
-                        #    GofraType.INTEGER,
-                        #    operator=operator,
-                        # )
-                        # context.pop_argument_type()
-                        context.consume_n_arguments(2)
-                    case Intrinsic.MEMORY_LOAD:
-                        context.raise_for_enough_arguments(operator, required_args=2)
-                        context.consume_n_arguments(2)
-                        context.push_types(GofraType.INTEGER)
-                        # context.pop_and_raise_for_argument_type(
-                        #    GofraType.POINTER,
-                        #    operator=operator,
-                        # )
-                        # context.pop_and_raise_for_argument_type(
-                        #    GofraType.INTEGER,
-                        #    operator=operator,
-                        # )
-                        # context.push_types(GofraType.INTEGER)
-                    case Intrinsic.INCREMENT | Intrinsic.DECREMENT:
-                        context.raise_for_enough_arguments(operator, required_args=1)
-                        context.pop_and_raise_for_argument_type(
-                            GofraType.INTEGER,
-                            operator=operator,
-                        )
-                        context.push_types(GofraType.INTEGER)
-                    case Intrinsic.DROP:
-                        context.raise_for_enough_arguments(operator, required_args=1)
-                        context.consume_n_arguments(args_to_consume=1)
-                    case (
-                        Intrinsic.EQUAL
-                        | Intrinsic.LESS_EQUAL_THAN
-                        | Intrinsic.LESS_THAN
-                        | Intrinsic.GREATER_EQUAL_THAN
-                        | Intrinsic.GREATER_THAN
-                        | Intrinsic.NOT_EQUAL
-                    ):
-                        context.raise_for_enough_arguments(operator, required_args=2)
-                        context.consume_n_arguments(args_to_consume=2)
-                        context.push_types(GofraType.BOOLEAN)
-                    case Intrinsic.MINUS | Intrinsic.PLUS:
-                        context.raise_for_enough_arguments(operator, required_args=2)
-
-                        b, a = (
-                            context.pop_argument_type(),
-                            context.pop_argument_type(),
-                        )
-
-                        if a == GofraType.POINTER:
-                            # Pointer arithmetics
-                            if b != GofraType.INTEGER:
-                                raise TypecheckInvalidPointerArithmeticsError(
-                                    actual_lhs_type=a,
-                                    actual_rhs_type=b,
-                                    operator=operator,
-                                )
-                            context.push_types(GofraType.POINTER)
-                            continue
-
-                        context.push_types(b, a)
-
-                        for _ in range(2):
-                            context.pop_and_raise_for_argument_type(
-                                GofraType.INTEGER,
-                                operator=operator,
-                            )
-
-                        context.push_types(GofraType.INTEGER)
-
-                    case Intrinsic.MULTIPLY | Intrinsic.DIVIDE | Intrinsic.MODULUS:
-                        # Math arithmetics operates only on integers
-                        # so no pointers/booleans/etc are allowed inside these intrinsics
-
-                        context.raise_for_enough_arguments(operator, required_args=2)
-                        b, a = context.pop_argument_type(), context.pop_argument_type()
-
-                        if b != GofraType.INTEGER or a != GofraType.INTEGER:
-                            raise TypecheckInvalidBinaryMathArithmeticsError(
-                                actual_lhs_type=a,
-                                actual_rhs_type=b,
-                                operator=operator,
-                            )
-
-                        context.push_types(GofraType.INTEGER)
-                    case (
-                        Intrinsic.SYSCALL0
-                        | Intrinsic.SYSCALL1
-                        | Intrinsic.SYSCALL2
-                        | Intrinsic.SYSCALL3
-                        | Intrinsic.SYSCALL4
-                        | Intrinsic.SYSCALL5
-                        | Intrinsic.SYSCALL6
-                    ):
-                        args_count = operator.get_syscall_arguments_count()
-
-                        injected_args = operator.syscall_optimization_injected_args
-                        if injected_args:
-                            types = [
-                                GofraType.INTEGER
-                                for injected_arg_value in injected_args
-                                if injected_arg_value is not None
-                            ]
-                            context.push_types(*types)
-                        context.raise_for_enough_arguments(operator, args_count)
-                        context.consume_n_arguments(args_count)
-
-                        if not operator.syscall_optimization_omit_result:
-                            context.push_types(GofraType.INTEGER)
-                    case Intrinsic.COPY:
-                        context.raise_for_enough_arguments(operator, required_args=1)
-
-                        arg_type = context.pop_argument_type()
-                        context.push_types(arg_type, arg_type)
-                    case Intrinsic.SWAP:
-                        context.raise_for_enough_arguments(operator, required_args=1)
-
-                        a = context.pop_argument_type()
-                        b = context.pop_argument_type()
-
-                        context.push_types(a, b)
-            case OperatorType.IF:
-                context.raise_for_enough_arguments(operator, required_args=1)
-                context.pop_and_raise_for_argument_type(
-                    GofraType.BOOLEAN,
-                    operator=operator,
-                )
-            case OperatorType.CALL:
-                func_name = str(operator.operand)
-                if func_name in getattr(program_context, 'extern_functions', set()):
-                    # Для extern-функций считаем, что они принимают и возвращают int (MVP)
-                    # Можно расширить для поддержки других типов
-                    context.raise_for_enough_arguments(operator, required_args=1)
-                    context.pop_and_raise_for_argument_type(GofraType.INTEGER, operator=operator)
-                    context.push_types(GofraType.INTEGER)
-                    continue
-                function = program_context.functions[func_name]
-
-                context.raise_for_enough_arguments(
-                    operator,
-                    required_args=len(function.type_contract_in),
-                )
-
-                for type_in in reversed(function.type_contract_in):
-                    context.pop_and_raise_for_argument_type(
-                        type_in,
-                        operator=operator,
-                    )
-                context.push_types(*function.type_contract_out)
-            case OperatorType.DO:
-                context.raise_for_enough_arguments(operator, required_args=1)
-                context.pop_and_raise_for_argument_type(
-                    GofraType.BOOLEAN,
-                    operator=operator,
-                )
+        if operator.type == _INTRINSIC_OPERATOR:
+            handler = intrinsic_handlers[operator.operand]  # type: ignore[index]
+        else:
+            handler = operator_handlers[operator.type]
+        handler(context, program_context, operator)
 
     if context.emulated_stack_types:
         raise TypecheckNonEmptyStackAtEndError(
             stack_size=len(context.emulated_stack_types),
         )
+
+
+def _make_simple(args_to_consume: int, *types: int) -> _Handler:
+    """Make handler that consumes given amount of arguments of any type and pushes given types."""
+
+    def handler(
+        context: TypecheckContext,
+        _program_context: ProgramContext,
+        operator: Operator,
+    ) -> None:
+        context.raise_for_enough_arguments(operator, required_args=args_to_consume)
+        context.consume_n_arguments(args_to_consume)
+        context.push_types(*types)
+
+    return handler
+
+
+def _typecheck_nothing(
+    _context: TypecheckContext,
+    _program_context: ProgramContext,
+    _operator: Operator,
+) -> None:
+    """Operators that do not touch the stack (e.g `while`, `end`)."""
+
+
+def _typecheck_push_integer(
+    context: TypecheckContext,
+    _program_context: ProgramContext,
+    operator: Operator,
+) -> None:
+    push_type = GofraType.INTEGER
+
+    if operator.has_optimizations and operator.infer_type_after_optimization:
+        push_type = operator.infer_type_after_optimization
+
+    context.push_types(push_type)
+
+
+def _typecheck_condition(
+    context: TypecheckContext,
+    _program_context: ProgramContext,
+    operator: Operator,
+) -> None:
+    context.raise_for_enough_arguments(operator, required_args=1)
+    context.pop_and_raise_for_argument_type(
+        GofraType.BOOLEAN,
+        operator=operator,
+    )
+
+
+def _typecheck_call(
+    context: TypecheckContext,
+    program_context: ProgramContext,
+    operator: Operator,
+) -> None:
+    func_name = str(operator.operand)
+    if func_name in context.extern_functions:
+        # Для extern-функций считаем, что они принимают и возвращают int (MVP)
+        # Можно расширить для поддержки других типов
+        context.raise_for_enough_arguments(operator, required_args=1)
+        context.pop_and_raise_for_argument_type(GofraType.INTEGER, operator=operator)
+        context.push_types(_INTEGER)
+        return
+    function = program_context.functions[func_name]
+
+    context.raise_for_enough_arguments(
+        operator,
+        required_args=len(function.type_contract_in),
+    )
+
+    for type_in in reversed(function.type_contract_in):
+        context.pop_and_raise_for_argument_type(
+            type_in,
+            operator=operator,
+        )
+    context.push_types(*function.type_contract_out)
+
+
+def _typecheck_increment(
+    context: TypecheckContext,
+    _program_context: ProgramContext,
+    operator: Operator,
+) -> None:
+    context.raise_for_enough_arguments(operator, required_args=1)
+    context.pop_and_raise_for_argument_type(
+        GofraType.INTEGER,
+        operator=operator,
+    )
+    context.push_types(_INTEGER)
+
+
+def _typecheck_plus_minus(
+    context: TypecheckContext,
+    _program_context: ProgramContext,
+    operator: Operator,
+) -> None:
+    context.raise_for_enough_arguments(operator, required_args=2)
+
+    stack = context.emulated_stack_types
+    b, a = stack.pop(), stack.pop()
+
+    if a == _POINTER:
+        # Pointer arithmetics
+        if b != _INTEGER:
+            raise TypecheckInvalidPointerArithmeticsError(
+                actual_lhs_type=GofraType(a),
+                actual_rhs_type=GofraType(b),
+                operator=operator,
+            )
+        context.push_types(_POINTER)
+        return
+
+    for arg_type in (a, b):
+        if arg_type != _INTEGER:
+            raise TypecheckInvalidArgumentTypeError(
+                expected_type=GofraType.INTEGER,
+                actual_type=GofraType(arg_type),
+                operator=operator,
+            )
+
+    context.push_types(_INTEGER)
+
+
+def _typecheck_binary_math(
+    context: TypecheckContext,
+    _program_context: ProgramContext,
+    operator: Operator,
+) -> None:
+    # Math arithmetics operates only on integers
+    # so no pointers/booleans/etc are allowed inside these intrinsics
+
+    context.raise_for_enough_arguments(operator, required_args=2)
+    stack = context.emulated_stack_types
+    b, a = stack.pop(), stack.pop()
+
+    if b != _INTEGER or a != _INTEGER:
+        raise TypecheckInvalidBinaryMathArithmeticsError(
+            actual_lhs_type=GofraType(a),
+            actual_rhs_type=GofraType(b),
+            operator=operator,
+        )
+
+    context.push_types(_INTEGER)
+
+
+def _make_syscall(args_count: int) -> _Handler:
+    """Make handler for syscall that takes given amount of arguments (including syscall number)."""
+
+    def handler(
+        context: TypecheckContext,
+        _program_context: ProgramContext,
+        operator: Operator,
+    ) -> None:
+        injected_args = operator.syscall_optimization_injected_args
+        if injected_args:
+            types = [
+                _INTEGER
+                for injected_arg_value in injected_args
+                if injected_arg_value is not None
+            ]
+            context.push_types(*types)
+        context.raise_for_enough_arguments(operator, args_count)
+        context.consume_n_arguments(args_count)
+
+        if not operator.syscall_optimization_omit_result:
+            context.push_types(_INTEGER)
+
+    return handler
+
+
+def _typecheck_copy(
+    context: TypecheckContext,
+    _program_context: ProgramContext,
+    operator: Operator,
+) -> None:
+    context.raise_for_enough_arguments(operator, required_args=1)
+
+    context.push_types(context.emulated_stack_types[-1])
+
+
+def _typecheck_swap(
+    context: TypecheckContext,
+    _program_context: ProgramContext,
+    operator: Operator,
+) -> None:
+    context.raise_for_enough_arguments(operator, required_args=1)
+
+    stack = context.emulated_stack_types
+    a = stack.pop()
+    b = stack.pop()
+
+    context.push_types(a, b)
+
+
+def _make_handlers_table(
+    handlers: Mapping[IntEnum, _Handler],
+    enum: type[IntEnum],
+) -> list[_Handler]:
+    """Make table of handlers indexed by value of enum member (members without handler does nothing)."""
+    table = [_typecheck_nothing] * (max(enum) + 1)
+    for member, handler in handlers.items():
+        table[member] = handler
+    return table
+
+
+# Handlers are indexed by operator type (or by intrinsic for intrinsic operators)
+# operators which are not here (e.g `while`, `end`) does nothing with the stack
+_INTRINSIC_OPERATOR = OperatorType.INTRINSIC
+_OPERATOR_HANDLERS = _make_handlers_table(
+    {
+        OperatorType.PUSH_INTEGER: _typecheck_push_integer,
+        OperatorType.PUSH_STRING: _make_simple(0, _POINTER, _INTEGER),
+        OperatorType.IF: _typecheck_condition,
+        OperatorType.DO: _typecheck_condition,
+        OperatorType.CALL: _typecheck_call,
+    },
+    OperatorType,
+)
+_INTRINSIC_HANDLERS = _make_handlers_table(
+    {
+        # Memory store/load are not validated for pointer/integer arguments yet
+        Intrinsic.MEMORY_STORE: _make_simple(2),
+        Intrinsic.MEMORY_LOAD: _make_simple(2, _INTEGER),
+        Intrinsic.INCREMENT: _typecheck_increment,
+        Intrinsic.DECREMENT: _typecheck_increment,
+        Intrinsic.DROP: _make_simple(1),
+        **dict.fromkeys(
+            (
+                Intrinsic.EQUAL,
+                Intrinsic.LESS_EQUAL_THAN,
+                Intrinsic.LESS_THAN,
+                Intrinsic.GREATER_EQUAL_THAN,
+                Intrinsic.GREATER_THAN,
+                Intrinsic.NOT_EQUAL,
+            ),
+            _make_simple(2, _BOOLEAN),
+        ),
+        Intrinsic.PLUS: _typecheck_plus_minus,
+        Intrinsic.MINUS: _typecheck_plus_minus,
+        Intrinsic.MULTIPLY: _typecheck_binary_math,
+        Intrinsic.DIVIDE: _typecheck_binary_math,
+        Intrinsic.MODULUS: _typecheck_binary_math,
+        **{
+            intrinsic: _make_syscall(args_count)
+            for intrinsic, args_count in SYSCALL_ARGUMENTS_COUNT.items()
+        },
+        Intrinsic.COPY: _typecheck_copy,
+        Intrinsic.SWAP: _typecheck_swap,
+    },
+    Intrinsic,
+)
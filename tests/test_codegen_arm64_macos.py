@@ -0,0 +1,350 @@
+import io
+import re
+import unittest
+from collections.abc import Callable
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from gofra.codegen.backends import generate_ARM64_MacOS_backend
+from gofra.codegen.backends.arm64_macos import (
+    _ARM64_COMPARE_AND_BRANCH_TEMPLATES,
+    _ARM64_INTRINSIC_TEMPLATES,
+    _move_immediate,
+    _peephole_fuse_sp,
+)
+from gofra.codegen.exceptions import CodegenIntegerOutOfRangeError
+from gofra.gofra import process_input_file
+from gofra.parser.intrinsics import Intrinsic
+
+
+def _generate_assembly(source: str, *, optimize: bool) -> list[str]:
+    """Generate assembly for given source and return its lines."""
+    with TemporaryDirectory() as directory:
+        filepath = Path(directory) / "source.gof"
+        filepath.write_text(source)
+        context = process_input_file(
+            filepath,
+            [filepath.parent],
+            optimize=optimize,
+            typecheck=False,
+        )
+
+    fd = io.StringIO()
+    generate_ARM64_MacOS_backend(fd, context, debug_comments=False)
+    return fd.getvalue().splitlines()
+
+
+def _generate_instructions(source: str, *, optimize: bool) -> list[str]:
+    """Generate assembly for given source and return instructions of the program body (after `_start`)."""
+    lines = _generate_assembly(source, optimize=optimize)
+    return [
+        line.strip()
+        for line in lines[lines.index("_start:") + 1 :]
+        if line.startswith("\t")
+    ]
+
+
+class TestSyscallInjectedArguments(unittest.TestCase):
+    def test_cached_top_of_stack_is_spilled_before_injected_x0(self) -> None:
+        # Every syscall argument is injected, so `5` (cached in X0) must be stored before X0 is overwritten
+        instructions = _generate_instructions(
+            "extern _show\n5 0 0 4 syscall2 drop call _show drop\n",
+            optimize=True,
+        )
+        spill = instructions.index("str X0, [SP, #-16]!")
+        self.assertLess(instructions.index("mov X0, #5"), spill)
+        self.assertLess(spill, instructions.index("mov X0, #0"))
+        self.assertLess(
+            instructions.index("svc #0"),
+            instructions.index("ldr X0, [SP], #16"),
+        )
+
+
+class TestStackPointerFusion(unittest.TestCase):
+    def test_pop_followed_by_push_cancels_out(self) -> None:
+        fused = _peephole_fuse_sp(["\tadd SP, SP, #16", "\tstr X0, [SP, #-16]!"])
+        self.assertEqual(fused, ["\tstr X0, [SP]"])
+
+    def test_deferred_displacement_is_materialized_before_control_flow(self) -> None:
+        fused = _peephole_fuse_sp(
+            ["\tadd SP, SP, #16", "\tldr X1, [SP], #16", "\tb .ctx_1"],
+        )
+        self.assertEqual(
+            fused,
+            ["\tldr X1, [SP, #16]", "\tadd SP, SP, #32", "\tb .ctx_1"],
+        )
+
+    def test_deferred_displacement_is_capped(self) -> None:
+        # Block with hundreds of pops, deferring all of them is not encodable within single `add`
+        fused = _peephole_fuse_sp(["\tadd SP, SP, #16", "\tldr X1, [SP], #16"] * 300)
+        displacement = 0
+        for instruction in fused:
+            if adjustment := re.fullmatch(r"\tadd SP, SP, #(\d+)", instruction):
+                self.assertLessEqual(int(adjustment[1]), 4095, instruction)
+                displacement += int(adjustment[1])
+            elif instruction.endswith("], #16"):
+                displacement += 16
+        self.assertEqual(displacement, 600 * 16)
+
+    def test_program_with_many_pops_in_block_is_encodable(self) -> None:
+        source = "%s\n1 1 == if 0 drop end drop\n%s\ndrop\n" % (
+            " ".join(map(str, range(1, 302))),
+            " +" * 299,
+        )
+        for optimize in (True, False):
+            for instruction in _generate_instructions(source, optimize=optimize):
+                if adjustment := re.fullmatch(
+                    r"(?:add|sub) SP, SP, #(\d+)",
+                    instruction,
+                ):
+                    self.assertLessEqual(int(adjustment[1]), 4095, instruction)
+
+
+_CONDITIONS: dict[str, Callable[[int, int], bool]] = {
+    "eq": int.__eq__,
+    "ne": int.__ne__,
+    "lt": int.__lt__,
+    "le": int.__le__,
+    "gt": int.__gt__,
+    "ge": int.__ge__,
+}
+
+
+def _evaluate_comparison(template: str, lhs: int, rhs: int) -> tuple[int, bool]:
+    """Evaluate comparison template with `lhs` on stack and `rhs` in X0, returns X0 and whether branch is taken."""
+    registers = {"X0": rhs}
+    flags = (0, 0)
+    branch_taken = False
+    for instruction in template.format(".ctx_1").splitlines():
+        mnemonic, _, operands = instruction.strip().partition(" ")
+        if mnemonic == "ldr":
+            registers["X1"] = lhs
+        elif mnemonic == "cmp":
+            first, second = operands.split(", ")
+            flags = (registers[first], registers[second])
+        elif mnemonic == "cset":
+            register, condition = operands.split(", ")
+            registers[register] = int(_CONDITIONS[condition](*flags))
+        else:
+            branch_taken = _CONDITIONS[mnemonic.removeprefix("b.")](*flags)
+    return registers["X0"], branch_taken
+
+
+class TestCompareAndBranch(unittest.TestCase):
+    def test_branch_is_taken_only_when_comparison_does_not_hold(self) -> None:
+        for intrinsic in (
+            Intrinsic.EQUAL,
+            Intrinsic.NOT_EQUAL,
+            Intrinsic.LESS_THAN,
+            Intrinsic.LESS_EQUAL_THAN,
+            Intrinsic.GREATER_THAN,
+            Intrinsic.GREATER_EQUAL_THAN,
+        ):
+            for lhs, rhs in ((1, 2), (2, 1), (2, 2), (-1, 1), (1, -1)):
+                with self.subTest(intrinsic=intrinsic, lhs=lhs, rhs=rhs):
+                    result, _ = _evaluate_comparison(
+                        _ARM64_INTRINSIC_TEMPLATES[intrinsic],
+                        lhs,
+                        rhs,
+                    )
+                    _, branch_taken = _evaluate_comparison(
+                        _ARM64_COMPARE_AND_BRANCH_TEMPLATES[intrinsic],
+                        lhs,
+                        rhs,
+                    )
+                    self.assertEqual(branch_taken, not result)
+
+    def test_comparison_consumed_by_condition_does_not_materialize_flag(self) -> None:
+        instructions = _generate_instructions("1 2 < if 3 drop end\n", optimize=False)
+        self.assertNotIn("cset X0, lt", instructions)
+        self.assertTrue([i for i in instructions if i.startswith("b.ge ")])
+
+
+class TestBranchIntoLayoutSuccessor(unittest.TestCase):
+    def test_branch_and_comparison_are_dropped(self) -> None:
+        # `if` body is optimized away, so both branch over it and its comparison are dead
+        instructions = _generate_instructions(
+            "5 copy 3 > if 0 drop end drop\n",
+            optimize=True,
+        )
+        self.assertFalse(
+            [i for i in instructions if i.startswith(("cmp ", "b.", "bne ", "beq "))],
+        )
+        # Popping operand of the comparison is still required
+        self.assertIn("ldr X1, [SP], #16", instructions)
+
+    def test_branch_over_non_empty_block_is_kept(self) -> None:
+        instructions = _generate_instructions(
+            "5 copy 3 > if 0 drop end drop\n",
+            optimize=False,
+        )
+        self.assertEqual(instructions[instructions.index("cmp X1, X0") + 1][:2], "b.")
+
+
+class TestFunctionInlining(unittest.TestCase):
+    def test_nested_small_functions_do_not_grow_exponentially(self) -> None:
+        # Every function is small when measured without expanding calls within it
+        source = "func void f0 1 drop end\n%scall f16\n" % "".join(
+            "func void f%d call f%d call f%d end\n" % (n, n - 1, n - 1)
+            for n in range(1, 17)
+        )
+        self.assertLess(len(_generate_assembly(source, optimize=False)), 100)
+
+    def test_function_called_once_is_expanded(self) -> None:
+        source = "func void big 1 drop 2 drop 3 drop 4 drop end\ncall big\n"
+        lines = _generate_assembly(source, optimize=False)
+        self.assertNotIn("big:", lines)
+        self.assertNotIn("\tbl big", lines)
+
+    def test_function_called_once_from_expanded_function_is_called(self) -> None:
+        # Expanding `big` into `small` would expand it at every call site of `small`
+        source = "func void big 1 drop 2 drop 3 drop 4 drop end\nfunc void small call big end\ncall small call small\n"
+        lines = _generate_assembly(source, optimize=False)
+        self.assertNotIn("small:", lines)
+        self.assertEqual(lines.count("big:"), 1)
+        self.assertEqual(lines.count("\tbl big"), 2)
+
+
+class TestFunctionReturn(unittest.TestCase):
+    def test_returned_value_is_top_of_the_stack(self) -> None:
+        # `int` function returns its top of the stack in X0 (whether it is cached at the end of the body or not)
+        for body in ("swap", "1 2 drop", '"ab" drop 7 !< 3 swap drop', "copy ?>"):
+            with self.subTest(body=body):
+                lines = _generate_assembly(
+                    "func int f %s end\n1 2 call f drop drop drop\n" % body,
+                    optimize=False,
+                )
+                function_body = lines[lines.index("f:") + 1 : lines.index("\tret")]
+                self.assertIn(
+                    function_body[-1],
+                    ("\tldr X0, [SP]", "\tstr X0, [SP, #-16]!"),
+                )
+
+    def test_returned_value_is_cached_as_top_of_the_stack(self) -> None:
+        instructions = _generate_instructions(
+            "extern _show\nfunc int f 1 2 drop end\ncall f call _show drop\n",
+            optimize=False,
+        )
+        self.assertEqual(instructions[: instructions.index("bl _show")], ["bl f"])
+
+
+def _evaluate_moves(instructions: str) -> int:
+    """Evaluate `mov`/`movz`/`movk`/`movn` instructions (with encodable immediates) into 64 bit register value."""
+    register = 0
+    for instruction in instructions.splitlines():
+        mnemonic, operands = instruction.strip().split(" ", 1)
+        immediate, *shift = re.findall(r"#(-?\d+)", operands)
+        chunk, shift_by = int(immediate), int(shift[0]) if shift else 0
+        # Immediate must be encodable within single instruction
+        assert -(2**16) <= chunk < 2**16 if mnemonic == "mov" else 0 <= chunk < 2**16, (
+            instruction
+        )
+        if mnemonic == "mov":
+            register = chunk
+        elif mnemonic == "movz":
+            register = chunk << shift_by
+        elif mnemonic == "movn":
+            register = ~(chunk << shift_by)
+        else:
+            mask = 0xFFFF << shift_by
+            register = (register & ~mask) | (chunk << shift_by)
+    return register & (2**64 - 1)
+
+
+class TestMoveImmediate(unittest.TestCase):
+    def test_boundary_values(self) -> None:
+        for value in (
+            0,
+            65535,
+            65536,
+            -65536,
+            -65537,
+            70000,
+            -70000,
+            0xFFFF0000,
+            0x0000FFFF0000FFFF,
+            2**63 - 1,
+            -(2**63),
+            2**64 - 1,
+        ):
+            with self.subTest(value=value):
+                instructions = _move_immediate("X0", value)
+                self.assertEqual(_evaluate_moves(instructions), value & (2**64 - 1))
+                self.assertLessEqual(len(instructions.splitlines()), 4)
+
+    def test_value_out_of_range(self) -> None:
+        for value in (2**64, -(2**63) - 1):
+            with (
+                self.subTest(value=value),
+                self.assertRaises(CodegenIntegerOutOfRangeError),
+            ):
+                _move_immediate("X0", value)
+
+    def test_long_string_length(self) -> None:
+        # Length of the string does not fit into single move
+        instructions = _generate_instructions(
+            'extern _show\n"%s" call _show drop drop\n' % ("a" * 70000),
+            optimize=False,
+        )
+        moves = instructions[
+            instructions.index("str X0, [SP, #-16]!") + 1 : instructions.index(
+                "bl _show",
+            )
+        ]
+        self.assertEqual(_evaluate_moves("\n".join(moves)), 70000)
+
+    def test_folded_value_out_of_range(self) -> None:
+        with self.assertRaises(CodegenIntegerOutOfRangeError):
+            _generate_instructions(
+                "extern _show\n9223372036854775807 305397760 * call _show drop\n",
+                optimize=True,
+            )
+
+
+def _fold(expression: str) -> int | None:
+    """Generate push of given expression and return its (signed) value if it is folded into moves only."""
+    instructions = _generate_instructions(
+        "extern _show\n%s call _show drop\n" % expression,
+        optimize=False,
+    )
+    moves = instructions[: instructions.index("bl _show")]
+    if not all(move.startswith(("mov ", "movz ", "movk ", "movn ")) for move in moves):
+        return None
+    value = _evaluate_moves("\n".join(moves))
+    return value - 2**64 if value >= 2**63 else value
+
+
+class TestIntegerFolding(unittest.TestCase):
+    def test_folded_as_emitted_instructions(self) -> None:
+        for expression, value in (
+            ("3 4 +", 7),
+            ("10 3 -", 7),
+            ("6 7 *", 42),
+            ("20 3 /", 6),
+            ("0 5 - 3 /", -1),
+            ("20 3 %", 2),
+            ("5 inc dec dec", 4),
+        ):
+            with self.subTest(expression=expression):
+                self.assertEqual(_fold(expression), value)
+
+    def test_unsigned_operands_are_folded_as_signed(self) -> None:
+        # Literals above signed range are negative at runtime (`sdiv` is signed)
+        self.assertEqual(_fold("5 inc 18446744073709551615 /"), -6)
+        self.assertEqual(_fold("9223372036854775808 2 /"), -(2**62))
+        self.assertEqual(_fold("18446744073709551615 inc"), 0)
+
+    def test_not_foldable_operators_are_emitted(self) -> None:
+        for expression in (
+            # Modulus is unsigned at runtime
+            "18446744073709551615 7 %",
+            "1 0 /",
+            # Overflow wraps at runtime
+            "9223372036854775807 inc",
+        ):
+            with self.subTest(expression=expression):
+                self.assertIsNone(_fold(expression))
+
+
+if __name__ == "__main__":
+    unittest.main()